@@ -1,27 +1,65 @@
 import os
-import json
+import re
+import time
+import random
 import asyncio
 import logging
-from typing import Optional, List, Dict
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import Optional, List, Dict, Tuple
 
+import aiohttp
 import cloudscraper
+import orjson
 from telegram import Bot, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.error import RetryAfter, TimedOut, TelegramError
-from requests import HTTPError
+from telegram.error import BadRequest, NetworkError, TelegramError
+from telegram.ext import AIORateLimiter, ExtBot
 from dotenv import load_dotenv
 
+try:
+    import uvloop
+except ImportError:  # на Windows uvloop нет — работаем на стандартном цикле
+    uvloop = None
+
 # Загрузка конфигурации
 load_dotenv()
 BOT_TOKEN     = os.getenv("BOT_TOKEN")
 CHANNEL_ID    = os.getenv("CHANNEL_ID")
 POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", 2))
 USER_AUTH     = os.getenv("USER_AUTH")
+# публикуем только подарки с таким началом backdrop (пусто — все)
+BACKDROP_PREFIX = os.getenv("BACKDROP_PREFIX", "")
 
 if not BOT_TOKEN or not CHANNEL_ID:
     raise RuntimeError("В .env должны быть заданы BOT_TOKEN и CHANNEL_ID")
 if not USER_AUTH:
     raise RuntimeError("В .env не задан USER_AUTH — скопируйте initData из DevTools")
 
+# сколько запросов floor одновременно держим в полёте
+FLOOR_CONCURRENCY = 8
+# сколько секунд доверяем закэшированному floor
+FLOOR_TTL        = max(POLL_INTERVAL, 5)
+FLOOR_CACHE_SIZE = 1024
+# сколько самых дешёвых листингов забираем пакетным запросом floor
+FLOOR_BATCH_LIMIT = 500
+# потолок паузы между опросами, пока API отвечает ошибками
+BACKOFF_MAX      = 60
+# сколько секунд держим простаивающее keep-alive соединение
+HTTP_KEEPALIVE   = 30
+
+# лимиты Telegram: 30 сообщений/сек всего, 20 сообщений/мин в один чат
+TG_GLOBAL_RATE = 30
+TG_CHAT_RATE   = 20
+# попытки отправки алерта (сетевые ошибки, RetryAfter) и потолок backoff
+SEND_ATTEMPTS    = 5
+SEND_BACKOFF_MAX = 10
+# сколько последних gift_num помним, чтобы не публиковать повторно
+MAX_SEEN = 4096
+# сколько алертов держим в очереди; публикует их один воркер — по порядку
+ALERT_QUEUE_SIZE = 256
+
 API_BASE = "https://gifts2.tonnel.network"
 API_URL  = f"{API_BASE}/api/pageGifts"
 
@@ -37,113 +75,366 @@ HEADERS = {
     )
 }
 
+# ссылки в алерте: gift_id; (normalize_name(name), gift_num)
+MARKET_URL = "https://t.me/tonnel_network_bot/gift?startapp=%s"
+GIF_URL    = "https://t.me/nft/%s-%s.gif"
+BUY_BUTTON_TEXT = "🛒 Buy on Market"
+# текст алерта: name, gift_num, price, floor all, floor model, model, symbol, backdrop, gif
+ALERT_TEMPLATE = (
+    "*🎁 %s* `#%s`\n"
+    "*Price:* `%s TON`\n\n"
+    "*all:* `%s`\n"
+    "*model:* `%s`\n\n"
+    "*Model:* `%s`\n"
+    "*Symbol:* `%s`\n"
+    "*Backdrop:* `%s`\n\n"
+    "🎬 [GIF](%s)"
+)
+
+# неизменные части запросов сериализуем один раз
+_ACTIVE_FILTER = {
+    "price":     {"$exists": True},
+    "refunded":  {"$ne":    True},
+    "buyer":     {"$exists": False},
+    "export_at": {"$exists": True},
+}
+_LISTINGS_SORT   = orjson.dumps({"message_post_time": -1, "gift_id": -1}).decode()
+_LISTINGS_FILTER = orjson.dumps(_ACTIVE_FILTER).decode()
+_FLOOR_SORT      = orjson.dumps({"price": 1}).decode()
+# при заданном BACKDROP_PREFIX чужие backdrop отсекает сервер
+_BACKDROP_FILTER = orjson.dumps(
+    {**_ACTIVE_FILTER, "backdrop": {"$regex": "^" + re.escape(BACKDROP_PREFIX)}}
+).decode() if BACKDROP_PREFIX else None
+# фильтр floor без gift_name/model и без закрывающей скобки
+_FLOOR_FILTER_HEAD = orjson.dumps({**_ACTIVE_FILTER, "asset": "TON"}).decode()[:-1]
+
 logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s",
     level=logging.DEBUG
 )
 logger = logging.getLogger(__name__)
 
+_ARROWS = ("🔻", "➖", "🔺")
+_NON_ALNUM_RE = re.compile(r"[\W_]+")
+_floor_sem = asyncio.Semaphore(FLOOR_CONCURRENCY)
+# (name, model) -> (момент протухания, floor)
+_floor_cache: Dict[Tuple[str, Optional[str]], Tuple[float, Optional[float]]] = {}
+_floor_inflight: Dict[Tuple[str, Optional[str]], asyncio.Future] = {}
+_MISS = object()
+
+
+def to_price(value) -> Optional[float]:
+    """Цена из JSON: числа оставляем как есть (чтобы 5 не стало 5.0 в тексте),
+    строки приводим к float один раз при разборе, а не в каждой арифметике."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(slots=True)
+class Listing:
+    """Листинг подарка — только те поля, что нужны монитору."""
+    gift_num: Optional[int]
+    gift_id:  Optional[int]
+    name:     str
+    price:    Optional[float]
+    model:    str
+    symbol:   str
+    backdrop: str
+
+    @classmethod
+    def from_doc(cls, d: Dict) -> "Listing":
+        return cls(
+            gift_num=d.get("gift_num"),
+            gift_id=d.get("gift_id"),
+            name=d.get("name", ""),
+            price=to_price(d.get("price")),
+            model=d.get("model", ""),
+            symbol=d.get("symbol", ""),
+            backdrop=d.get("backdrop", ""),
+        )
+
+
+class FloorBatchUnsupported(Exception):
+    """Сервер не понимает пакетный запрос floor (gift_name $in)."""
+
+
+class ListingsError(Exception):
+    """Листинги получить не удалось; status — HTTP-код, если ответ был,
+    retry_after — сколько секунд сервер просил подождать (429)."""
+
+    def __init__(self, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(status)
+        self.status = status
+        self.retry_after = retry_after
 
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After бывает числом секунд или HTTP-датой."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=4096)
 def normalize_name(name: str) -> str:
     """Убираем всё, кроме букв и цифр, для формирования url-base."""
-    return ''.join(ch for ch in name if ch.isalnum())
+    return _NON_ALNUM_RE.sub("", name)
 
 
-def fetch_listings(scraper) -> List[Dict]:
-    """Получаем последние 30 листингов."""
+async def fetch_listings(session: aiohttp.ClientSession, listings_filter: str = _LISTINGS_FILTER) -> List[Listing]:
+    """Получаем последние 30 листингов; при сбое — ListingsError."""
     payload = {
         "page":        1,
         "limit":       30,
-        "sort":        json.dumps({"message_post_time": -1, "gift_id": -1}),
-        "filter":      json.dumps({
-            "price":     {"$exists": True},
-            "refunded":  {"$ne":    True},
-            "buyer":     {"$exists": False},
-            "export_at": {"$exists": True}
-        }),
+        "sort":        _LISTINGS_SORT,
+        "filter":      listings_filter,
         "price_range": None,
         "ref":         0,
         "user_auth":   USER_AUTH,
     }
     try:
-        resp = scraper.post(API_URL, json=payload, headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
-        return data if isinstance(data, list) else data.get("data") or data.get("docs") or []
-    except HTTPError as e:
+        async with session.post(API_URL, data=orjson.dumps(payload)) as resp:
+            resp.raise_for_status()
+            data = orjson.loads(await resp.read())
+        docs = data if isinstance(data, list) else data.get("data") or data.get("docs") or []
+        return [Listing.from_doc(d) for d in docs]
+    except aiohttp.ClientResponseError as e:
         logger.error("HTTP error fetching listings: %s", e)
-    except Exception:
+        retry_after = None
+        if e.status == 429:
+            retry_after = parse_retry_after((e.headers or {}).get("Retry-After"))
+        raise ListingsError(e.status, retry_after) from e
+    except Exception as e:
         logger.exception("Unexpected error fetching listings")
-    return []
+        raise ListingsError() from e
 
 
-def fetch_floor_price(scraper, name: str, model: Optional[str] = None) -> Optional[float]:
-    """Берём минимальную цену (floor) для коллекции или конкретной модели."""
-    flt = {
-        "price":     {"$exists": True},
-        "refunded":  {"$ne":    True},
-        "buyer":     {"$exists": False},
-        "export_at": {"$exists": True},
-        "gift_name": name,
-        "asset":     "TON",
-    }
+async def fetch_filtered_listings(session: aiohttp.ClientSession, listings_filter: str) -> Tuple[List[Listing], str]:
+    """Листинги с серверным фильтром backdrop и фильтр для следующих опросов.
+
+    Если сервер фильтр отверг (400) или проигнорировал (вернул чужие
+    backdrop) — дальше фильтруем только на клиенте. Пустая страница ни о
+    чём не говорит: подходящих листингов просто может не быть."""
+    if listings_filter is _LISTINGS_FILTER:
+        return await fetch_listings(session), _LISTINGS_FILTER
+
+    try:
+        docs = await fetch_listings(session, listings_filter)
+    except ListingsError as e:
+        if e.status != 400:
+            raise
+        logger.warning("Server rejected the backdrop filter, filtering on the client")
+        return await fetch_listings(session), _LISTINGS_FILTER
+
+    if any(not g.backdrop.startswith(BACKDROP_PREFIX) for g in docs):
+        logger.warning("Server ignored the backdrop filter, filtering on the client")
+        return docs, _LISTINGS_FILTER
+    return docs, listings_filter
+
+
+def _floor_filter(gift_name, model: Optional[str] = None) -> str:
+    """JSON-фильтр floor: к готовому префиксу дописываем только переменные поля."""
+    flt = _FLOOR_FILTER_HEAD + ',"gift_name":' + orjson.dumps(gift_name).decode()
     if model:
-        flt["model"] = model
+        flt += ',"model":' + orjson.dumps(model).decode()
+    return flt + "}"
+
+
+def _cache_get(key: Tuple[str, Optional[str]]):
+    """Floor из кэша или _MISS, если его нет или он протух."""
+    cached = _floor_cache.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    return _MISS
+
+
+def _cache_put(key: Tuple[str, Optional[str]], floor: Optional[float]):
+    if len(_floor_cache) >= FLOOR_CACHE_SIZE:
+        _floor_cache.pop(next(iter(_floor_cache)))
+    _floor_cache[key] = (time.monotonic() + FLOOR_TTL, floor)
 
+
+async def fetch_floor_price(session: aiohttp.ClientSession, name: str, model: Optional[str] = None) -> Optional[float]:
+    """Берём минимальную цену (floor) для коллекции или конкретной модели."""
+    key = (name, model or None)
+    cached = _cache_get(key)
+    if cached is not _MISS:
+        return cached
+
+    # такой же запрос уже в полёте — ждём его, а не шлём второй;
+    # без shield отмена poll доходит до запроса и не переживает сессию
+    task = _floor_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_request_floor_price(session, key))
+        _floor_inflight[key] = task
+        task.add_done_callback(lambda _: _floor_inflight.pop(key, None))
+    return await task
+
+
+async def _request_floor_price(session: aiohttp.ClientSession, key: Tuple[str, Optional[str]]) -> Optional[float]:
+    name, model = key
     payload = {
         "page":        1,
         "limit":       1,
-        "sort":        json.dumps({"price": 1}),
-        "filter":      json.dumps(flt),
+        "sort":        _FLOOR_SORT,
+        "filter":      _floor_filter(name, model),
         "price_range": None,
         "ref":         0,
         "user_auth":   USER_AUTH,
     }
     try:
-        resp = scraper.post(API_URL, json=payload, headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
+        async with _floor_sem, session.post(API_URL, data=orjson.dumps(payload)) as resp:
+            resp.raise_for_status()
+            data = orjson.loads(await resp.read())
         docs = data if isinstance(data, list) else data.get("data") or data.get("docs") or []
-        return docs[0]["price"] if docs else None
-    except HTTPError as e:
+        floor = to_price(docs[0]["price"]) if docs else None
+        _cache_put(key, floor)
+        return floor
+    except aiohttp.ClientResponseError as e:
         logger.error("HTTP error fetching floor price: %s", e)
     except Exception:
         logger.exception("Unexpected error fetching floor price")
     return None
 
 
-async def send_alert(bot: Bot, chat_id: str, text: str, keyboard: InlineKeyboardMarkup):
-    """Шлём сообщение с инлайн-кнопкой, обрабатывая rate-limit."""
+async def fetch_floor_docs(session: aiohttp.ClientSession, names: List[str]) -> Optional[List[Dict]]:
+    """Самые дешёвые листинги сразу по нескольким коллекциям, по возрастанию цены.
+
+    None — разовый сбой; FloorBatchUnsupported — сервер $in не понимает."""
+    payload = {
+        "page":        1,
+        "limit":       FLOOR_BATCH_LIMIT,
+        "sort":        _FLOOR_SORT,
+        "filter":      _floor_filter({"$in": names}),
+        "price_range": None,
+        "ref":         0,
+        "user_auth":   USER_AUTH,
+    }
     try:
-        await bot.send_message(
-            chat_id=chat_id,
-            text=text,
-            parse_mode="Markdown",
-            reply_markup=keyboard,
-            disable_web_page_preview=False
-        )
-    except RetryAfter as e:
-        await asyncio.sleep(e.retry_after)
-        await bot.send_message(
-            chat_id=chat_id,
-            text=text,
-            parse_mode="Markdown",
-            reply_markup=keyboard,
-            disable_web_page_preview=False
-        )
-    except TimedOut:
-        await asyncio.sleep(5)
-        await bot.send_message(
-            chat_id=chat_id,
-            text=text,
-            parse_mode="Markdown",
-            reply_markup=keyboard,
-            disable_web_page_preview=False
-        )
-    except TelegramError as e:
-        logger.error("Telegram error: %s", e)
-    # throttle: не чаще 1 сообщения в 3 секунды
-    await asyncio.sleep(3)
+        async with _floor_sem, session.post(API_URL, data=orjson.dumps(payload)) as resp:
+            resp.raise_for_status()
+            data = orjson.loads(await resp.read())
+        docs = data if isinstance(data, list) else data.get("data") or data.get("docs") or []
+        wanted = set(names)
+        if any(d.get("name") not in wanted for d in docs):
+            # фильтр $in проигнорирован — такой ответ для floor не годится
+            logger.warning("Batch floor query returned foreign collections, using per-key lookups")
+            raise FloorBatchUnsupported()
+        return docs
+    except aiohttp.ClientResponseError as e:
+        if e.status == 400:
+            logger.warning("Server rejected the batch floor query, using per-key lookups")
+            raise FloorBatchUnsupported() from e
+        logger.error("HTTP error fetching floor batch: %s", e)
+    except FloorBatchUnsupported:
+        raise
+    except Exception:
+        logger.exception("Unexpected error fetching floor batch")
+    return None
+
+
+async def resolve_floors(
+    session: aiohttp.ClientSession,
+    gifts: List[Listing],
+    use_batch: bool = True,
+) -> Tuple[Dict[Tuple[str, Optional[str]], Optional[float]], bool]:
+    """Floor коллекций и моделей для подарков тика и флаг use_batch для
+    следующих тиков: один пакетный запрос, поштучные — для ключей, которых
+    в пакете не оказалось. Если сервер пакет не понимает — дальше только
+    поштучные."""
+    keys = set()
+    for g in gifts:
+        keys.add((g.name, None))
+        keys.add((g.name, g.model or None))
+
+    floors = {}
+    missing = []
+    for key in keys:
+        cached = _cache_get(key)
+        if cached is _MISS:
+            missing.append(key)
+        else:
+            floors[key] = cached
+    if not missing:
+        return floors, use_batch
+
+    docs = None
+    if use_batch:
+        try:
+            docs = await fetch_floor_docs(session, sorted({name for name, _ in missing}))
+        except FloorBatchUnsupported:
+            use_batch = False
+    if docs is not None:
+        # docs отсортированы по цене, поэтому первое вхождение ключа — его floor
+        batch = {}
+        for d in docs:
+            price = to_price(d.get("price"))
+            if price is None:
+                continue
+            batch.setdefault((d.get("name"), None), price)
+            batch.setdefault((d.get("name"), d.get("model") or None), price)
+        # подарок в продаже всегда есть среди листингов своей коллекции и модели,
+        # так что отсутствующий ключ значит лишь, что пакет обрезан (сервер мог
+        # урезать limit) — такие ключи добираем поштучно, None не выдумываем
+        rest = []
+        for key in missing:
+            if key in batch:
+                floors[key] = batch[key]
+                _cache_put(key, floors[key])
+            else:
+                rest.append(key)
+        missing = rest
+
+    if missing:
+        values = await asyncio.gather(*(fetch_floor_price(session, n, m) for n, m in missing))
+        floors.update(zip(missing, values))
+    return floors, use_batch
+
+
+def invalidate_floors(name: str, model: Optional[str], price: float):
+    """Новый листинг дешевле закэшированного floor — такой floor уже неверен."""
+    for key in ((name, None), (name, model or None)):
+        cached = _floor_cache.get(key)
+        if cached is not None and (cached[1] is None or price < cached[1]):
+            del _floor_cache[key]
+
+
+async def send_alert(bot: Bot, chat_id: str, text: str, keyboard: InlineKeyboardMarkup):
+    """Шлём сообщение с инлайн-кнопкой; rate-limit и RetryAfter берёт на себя AIORateLimiter."""
+    delay = 0.1
+    for _ in range(SEND_ATTEMPTS):
+        try:
+            await bot.send_message(
+                chat_id=chat_id,
+                text=text,
+                parse_mode="Markdown",
+                reply_markup=keyboard,
+                disable_web_page_preview=False
+            )
+            return
+        except BadRequest as e:
+            # в PTB BadRequest — подкласс NetworkError, но повтор тут не поможет
+            logger.error("Telegram error: %s", e)
+            return
+        except NetworkError as e:
+            # сюда же попадает TimedOut
+            logger.warning("Telegram network error, retrying in %.1fs: %s", delay, e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, SEND_BACKOFF_MAX)
+        except TelegramError as e:
+            logger.error("Telegram error: %s", e)
+            return
+    logger.error("Giving up on alert after %d attempts", SEND_ATTEMPTS)
 
 
 def fmt_floor(price: float, floor: Optional[float]) -> tuple[str, float]:
@@ -151,82 +442,180 @@ def fmt_floor(price: float, floor: Optional[float]) -> tuple[str, float]:
     if floor is None or floor == 0:
         return "— TON (+0.0%)", 0.0
     pct = (price - floor) / floor * 100
-    arrow = "➖" if abs(pct) < 0.05 else ("🔻" if pct < 0 else "🔺")
+    # 0: pct <= -0.05, 1: |pct| < 0.05, 2: pct >= 0.05
+    arrow = _ARROWS[(pct >= 0.05) + (pct > -0.05)]
     return f"{floor} TON ({arrow}{pct:+.1f}%)", pct
 
 
 async def monitor():
     logger.info("🚀 Старт мониторинга …")
-    bot = Bot(token=BOT_TOKEN)
+    # token-bucket по лимитам Telegram (общий и на чат); на RetryAfter
+    # лимитер сам ставит на паузу все запросы бота и повторяет отправку
+    bot = ExtBot(
+        token=BOT_TOKEN,
+        rate_limiter=AIORateLimiter(
+            overall_max_rate=TG_GLOBAL_RATE,
+            overall_time_period=1,
+            group_max_rate=TG_CHAT_RATE,
+            group_time_period=60,
+            max_retries=SEND_ATTEMPTS,
+        ),
+    )
+
+    # Cloudflare-челлендж проходим один раз через cloudscraper,
+    # дальше работаем асинхронно с полученными cookies
     scraper = cloudscraper.create_scraper()
     scraper.get(API_BASE)
+    cookies = {c.name: c.value for c in scraper.cookies}
+    # cf_clearance привязан к User-Agent, с которым пройден челлендж
+    headers = {**HEADERS, "User-Agent": scraper.headers["User-Agent"]}
+
+    # один пул keep-alive соединений на всё время работы: TCP+TLS
+    # поднимаются один раз, а не на каждый запрос floor
+    connector = aiohttp.TCPConnector(
+        limit_per_host=FLOOR_CONCURRENCY,
+        keepalive_timeout=HTTP_KEEPALIVE,
+    )
+    async with bot, aiohttp.ClientSession(
+        connector=connector,
+        headers=headers,
+        cookies=cookies,
+    ) as session:
+        await poll(bot, session)
+
+
+def buy_keyboard(url: str) -> InlineKeyboardMarkup:
+    """Инлайн-кнопка «Buy on Market» — от подарка к подарку меняется только url."""
+    return InlineKeyboardMarkup(((InlineKeyboardButton(BUY_BUTTON_TEXT, url=url),),))
 
-    seen = set()
-    first_run = True
-    loop = asyncio.get_event_loop()
 
+async def publish_gift(bot: Bot, g: Listing, floor_all: Optional[float], floor_mod: Optional[float]):
+    """Собираем сообщение по подарку и публикуем его в канал."""
+    gift_num = g.gift_num
+    name     = g.name
+    price    = g.price
+    model    = g.model
+    symbol   = g.symbol
+    backdrop = g.backdrop
+    key      = normalize_name(name)
+
+    # формируем ссылки
+    market_link = MARKET_URL % g.gift_id
+    gif_url     = GIF_URL % (key, gift_num)
+
+    fa_str, _ = fmt_floor(price, floor_all)
+    fm_str, _ = fmt_floor(price, floor_mod)
+
+    # готовим текст сообщения
+    msg = ALERT_TEMPLATE % (name, gift_num, price, fa_str, fm_str, model, symbol, backdrop, gif_url)
+
+    logger.debug("🔔 Publishing discounted gift #%s", gift_num)
+    await send_alert(bot, CHANNEL_ID, msg, buy_keyboard(market_link))
+
+
+def enqueue_alert(queue: asyncio.Queue, item: Tuple[Listing, Optional[float], Optional[float]]):
+    """Кладём алерт в очередь, не блокируя опрос: при переполнении
+    выкидываем самый старый — свежая скидка важнее."""
+    if queue.full():
+        dropped, _, _ = queue.get_nowait()
+        queue.task_done()
+        logger.warning("Alert queue full, dropping gift #%s", dropped.gift_num)
+    queue.put_nowait(item)
+
+
+async def alert_worker(bot: Bot, queue: asyncio.Queue):
+    """Разбираем очередь найденных подарков, пока монитор продолжает опрос."""
     while True:
-        docs = await loop.run_in_executor(None, fetch_listings, scraper)
-        if not docs:
-            await asyncio.sleep(POLL_INTERVAL)
-            continue
+        g, floor_all, floor_mod = await queue.get()
+        try:
+            await publish_gift(bot, g, floor_all, floor_mod)
+        except Exception:
+            logger.exception("Unexpected error publishing gift #%s", g.gift_num)
+        finally:
+            queue.task_done()
 
-        # на первом проходе — только самый последний, потом — все55
-        to_proc = [docs[0]] if first_run else docs
-        first_run = False
 
-        for g in to_proc:
-            gift_num = g.get("gift_num")
-            if gift_num in seen:
-                continue
-            seen.add(gift_num)
-
-            name     = g.get("name", "")
-            price    = g.get("price", 0)
-            model    = g.get("model", "")
-            symbol   = g.get("symbol", "")
-            backdrop = g.get("backdrop", "")
-            key      = normalize_name(name)
-
-            # вычисляем floor для коллекции и модели
-            floor_all = await loop.run_in_executor(None, fetch_floor_price, scraper, name)
-            floor_mod = await loop.run_in_executor(None, fetch_floor_price, scraper, name, model)
-
-            # условие: цена <= 90% от любого флора
-            cond_all = (floor_all is not None and price <= floor_all * 0.9)
-            cond_mod = (floor_mod is not None and price <= floor_mod * 0.9)
-            if not (cond_all or cond_mod):
-                continue
+async def poll(bot: Bot, session: aiohttp.ClientSession):
+    seen: OrderedDict = OrderedDict()
+    first_run = True
+    last_top_id = None
+    backoff = POLL_INTERVAL
+    listings_filter = _BACKDROP_FILTER or _LISTINGS_FILTER
+    use_batch = True
 
-            # формируем ссылки
-            market_link = f"https://t.me/tonnel_network_bot/gift?startapp={g['gift_id']}"
-            gif_url     = f"https://t.me/nft/{key}-{gift_num}.gif"
-
-            fa_str, _ = fmt_floor(price, floor_all)
-            fm_str, _ = fmt_floor(price, floor_mod)
-
-            # готовим текст сообщения
-            msg = (
-                f"*🎁 {name}* `#{gift_num}`\n"
-                f"*Price:* `{price} TON`\n\n"
-                f"*all:* `{fa_str}`\n"
-                f"*model:* `{fm_str}`\n\n"
-                f"*Model:* `{model}`\n"
-                f"*Symbol:* `{symbol}`\n"
-                f"*Backdrop:* `{backdrop}`\n\n"
-                f"🎬 [GIF]({gif_url})"
-            )
+    queue: asyncio.Queue = asyncio.Queue(maxsize=ALERT_QUEUE_SIZE)
+    # в один канал параллельная отправка не быстрее (лимит на чат),
+    # зато перемешивает алерты — публикует один воркер
+    worker = asyncio.create_task(alert_worker(bot, queue))
 
-            # инлайн-кнопка «Buy on Market»
-            keyboard = InlineKeyboardMarkup(
-                [[InlineKeyboardButton("🛒 Buy on Market", url=market_link)]]
-            )
+    try:
+        while True:
+            try:
+                docs, listings_filter = await fetch_filtered_listings(session, listings_filter)
+            except ListingsError as e:
+                # API сбоит — не долбим его, а растягиваем паузу (с джиттером);
+                # если сервер сам назвал паузу (429) — ждём не меньше неё
+                delay = backoff + random.uniform(0, backoff * 0.1)
+                await asyncio.sleep(max(e.retry_after or 0, delay))
+                backoff = min(backoff * 2, BACKOFF_MAX)
+                continue
+            backoff = POLL_INTERVAL
+            if not docs:
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
 
-            logger.debug("🔔 Publishing discounted gift #%s", gift_num)
-            await send_alert(bot, CHANNEL_ID, msg, keyboard)
+            # новые листинги приходят сверху: та же верхушка — рынок стоит
+            top_id = docs[0].gift_id
+            if top_id is not None and top_id == last_top_id:
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            last_top_id = top_id
+
+            # на первом проходе — только самый последний, потом — все55
+            to_proc = [docs[0]] if first_run else docs
+            first_run = False
+
+            new = []
+            for g in to_proc:
+                if g.price is None:
+                    # цену не разобрали — ни floor по ней не правим, ни алерт не шлём
+                    continue
+                if g.gift_num in seen:
+                    # ещё висит в выдаче — держим запись свежей
+                    seen.move_to_end(g.gift_num)
+                    continue
+                invalidate_floors(g.name, g.model, g.price)
+                # дешёвые проверки — до любых сетевых запросов; неподходящий
+                # подарок не запоминаем в seen
+                if not g.backdrop.startswith(BACKDROP_PREFIX):
+                    continue
+                seen[g.gift_num] = None
+                if len(seen) > MAX_SEEN:
+                    seen.popitem(last=False)
+                new.append(g)
+
+            # вычисляем floor для коллекции и модели — по разу на уникальный ключ
+            floors, use_batch = await resolve_floors(session, new, use_batch)
+
+            for g in new:
+                price     = g.price
+                floor_all = floors[(g.name, None)]
+                floor_mod = floors[(g.name, g.model or None)]
+
+                # условие: цена <= 90% от любого флора
+                cond_all = (floor_all is not None and price <= floor_all * 0.9)
+                cond_mod = (floor_mod is not None and price <= floor_mod * 0.9)
+                if cond_all or cond_mod:
+                    enqueue_alert(queue, (g, floor_all, floor_mod))
 
-        await asyncio.sleep(POLL_INTERVAL)
+            await asyncio.sleep(POLL_INTERVAL)
+    finally:
+        worker.cancel()
+        # дожидаемся воркера, чтобы бот не закрылся посреди send_message
+        await asyncio.gather(worker, return_exceptions=True)
 
 
 if __name__ == "__main__":
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     asyncio.run(monitor())
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# bot.py проверяет конфигурацию при импорте
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("CHANNEL_ID", "@test")
+os.environ.setdefault("USER_AUTH", "test-auth")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
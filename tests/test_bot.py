@@ -0,0 +1,276 @@
+import asyncio
+import json
+import re
+
+import aiohttp
+import pytest
+from multidict import CIMultiDict, CIMultiDictProxy
+from telegram.error import BadRequest, TimedOut
+from yarl import URL
+
+import bot
+
+
+def http_error(status):
+    info = aiohttp.RequestInfo(URL(bot.API_URL), "POST", CIMultiDictProxy(CIMultiDict()))
+    return aiohttp.ClientResponseError(info, (), status=status, headers={})
+
+
+class FakeResponse:
+    def __init__(self, body, status=200):
+        self.body = body
+        self.status = status
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise http_error(self.status)
+
+    async def read(self):
+        return json.dumps(self.body).encode()
+
+
+class FakeSession:
+    """Фейковый pageGifts: листинги (limit 30) и floor-запросы с учётом фильтра.
+
+    batch и backdrop — ответ на пакетный gift_name $in и на фильтр backdrop:
+    "ok", "ignore" (фильтр игнорируется) или HTTP-код ошибки; page_cap —
+    сколько строк сервер отдаёт за раз, даже если просили больше."""
+
+    def __init__(self, listings=(), floors=(), batch="ok", page_cap=None, backdrop="ok"):
+        self.listings = list(listings)
+        self.floors = list(floors)
+        self.batch = batch
+        self.backdrop = backdrop
+        self.page_cap = page_cap
+        self.requests = []
+
+    def count(self, kind):
+        return sum(1 for k, _ in self.requests if k == kind)
+
+    def post(self, url, data):
+        payload = json.loads(data)
+        flt = json.loads(payload["filter"])
+        if payload["limit"] == 30:
+            if "backdrop" not in flt:
+                self.requests.append(("listings", flt))
+                return FakeResponse(self.listings)
+            self.requests.append(("filtered", flt))
+            if isinstance(self.backdrop, int):
+                return FakeResponse(None, status=self.backdrop)
+            docs = self.listings
+            if self.backdrop == "ok":
+                docs = [d for d in docs if re.match(flt["backdrop"]["$regex"], d["backdrop"])]
+            return FakeResponse(docs)
+
+        gift_name = flt["gift_name"]
+        if isinstance(gift_name, dict):
+            self.requests.append(("batch", flt))
+            if isinstance(self.batch, int):
+                return FakeResponse(None, status=self.batch)
+            docs = self.floors
+            if self.batch == "ok":
+                docs = [d for d in docs if d["name"] in gift_name["$in"]]
+        else:
+            self.requests.append(("floor", flt))
+            docs = [
+                d for d in self.floors
+                if d["name"] == gift_name and ("model" not in flt or d["model"] == flt["model"])
+            ]
+        limit = min(payload["limit"], self.page_cap or payload["limit"])
+        return FakeResponse(sorted(docs, key=lambda d: d["price"])[:limit])
+
+
+class FakeBot:
+    """Записывает отправленное; errors — исключения на первые вызовы по очереди."""
+
+    def __init__(self, errors=()):
+        self.sent = []
+        self.calls = 0
+        self.errors = list(errors)
+
+    async def send_message(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(kwargs)
+
+
+@pytest.fixture(autouse=True)
+def clean_floor_cache():
+    bot._floor_cache.clear()
+    bot._floor_inflight.clear()
+    yield
+    bot._floor_cache.clear()
+    bot._floor_inflight.clear()
+
+
+def listing_doc(gift_id, backdrop):
+    return {
+        "gift_num": gift_id, "gift_id": gift_id, "name": "A",
+        "price": 5, "model": "m", "symbol": "s", "backdrop": backdrop,
+    }
+
+
+def gift(name="A", model="rare", price=9):
+    return bot.Listing(
+        gift_num=1, gift_id=1, name=name, price=price,
+        model=model, symbol="", backdrop="",
+    )
+
+
+# в коллекции A много дешёвых common и одна rare
+FLOORS_A = [{"name": "A", "model": "common", "price": p} for p in (1, 2, 3, 4, 5)] + [
+    {"name": "A", "model": "rare", "price": 10},
+]
+
+
+def test_unparseable_price_is_none():
+    assert bot.Listing.from_doc({"price": "n/a"}).price is None
+    assert bot.Listing.from_doc({}).price is None
+    assert bot.Listing.from_doc({"price": "12.5"}).price == 12.5
+    assert bot.Listing.from_doc({"price": 5}).price == 5
+
+
+def test_poll_skips_listing_without_price():
+    listing = {
+        "gift_num": 1, "gift_id": 10, "name": "Plush Pepe",
+        "price": "n/a", "model": "A", "symbol": "s", "backdrop": "b",
+    }
+    floors = [{"name": "Plush Pepe", "model": "A", "price": 100}]
+    session = FakeSession([listing], floors)
+    fake_bot = FakeBot()
+
+    async def run():
+        task = asyncio.create_task(bot.poll(fake_bot, session))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+
+    assert fake_bot.sent == []
+    assert session.count("batch") == session.count("floor") == 0
+
+
+def test_resolve_floors_truncated_batch_falls_back_per_key():
+    # сервер отдаёт 3 строки вместо 500: rare в пакет не попала
+    session = FakeSession(floors=FLOORS_A, page_cap=3)
+
+    floors, use_batch = asyncio.run(bot.resolve_floors(session, [gift()]))
+
+    assert floors == {("A", None): 1, ("A", "rare"): 10}
+    assert use_batch is True
+    assert session.count("batch") == 1
+    assert session.count("floor") == 1
+
+
+def test_resolve_floors_batch_rejected_disables_batch():
+    session = FakeSession(floors=FLOORS_A, batch=400)
+
+    floors, use_batch = asyncio.run(bot.resolve_floors(session, [gift()]))
+
+    assert floors == {("A", None): 1, ("A", "rare"): 10}
+    assert use_batch is False
+    assert session.count("batch") == 1
+    assert session.count("floor") == 2
+
+    # следующий тик пакет уже не пробует
+    bot._floor_cache.clear()
+    floors, use_batch = asyncio.run(bot.resolve_floors(session, [gift()], use_batch))
+
+    assert floors == {("A", None): 1, ("A", "rare"): 10}
+    assert use_batch is False
+    assert session.count("batch") == 1
+    assert session.count("floor") == 4
+
+
+def test_resolve_floors_foreign_collections_disable_batch():
+    session = FakeSession(
+        floors=FLOORS_A + [{"name": "B", "model": "x", "price": 0.5}],
+        batch="ignore",
+    )
+
+    floors, use_batch = asyncio.run(bot.resolve_floors(session, [gift()]))
+
+    assert floors == {("A", None): 1, ("A", "rare"): 10}
+    assert use_batch is False
+    assert session.count("batch") == 1
+    assert session.count("floor") == 2
+
+
+@pytest.fixture
+def backdrop_filter(monkeypatch):
+    monkeypatch.setattr(bot, "BACKDROP_PREFIX", "Black")
+    return json.dumps({**bot._ACTIVE_FILTER, "backdrop": {"$regex": "^Black"}})
+
+
+LISTINGS = [listing_doc(1, "Black Onyx"), listing_doc(2, "Ivory White")]
+
+
+def test_backdrop_filter_rejected_falls_back_to_client(backdrop_filter):
+    session = FakeSession(LISTINGS, backdrop=400)
+
+    docs, flt = asyncio.run(bot.fetch_filtered_listings(session, backdrop_filter))
+
+    assert [g.gift_id for g in docs] == [1, 2]
+    assert flt is bot._LISTINGS_FILTER
+    assert session.count("filtered") == 1
+    assert session.count("listings") == 1
+
+
+def test_backdrop_filter_ignored_falls_back_to_client(backdrop_filter):
+    session = FakeSession(LISTINGS, backdrop="ignore")
+
+    docs, flt = asyncio.run(bot.fetch_filtered_listings(session, backdrop_filter))
+
+    assert [g.gift_id for g in docs] == [1, 2]
+    assert flt is bot._LISTINGS_FILTER
+    assert session.count("filtered") == 1
+    assert session.count("listings") == 0
+
+
+def test_backdrop_filter_kept_when_it_works(backdrop_filter):
+    session = FakeSession(LISTINGS)
+
+    docs, flt = asyncio.run(bot.fetch_filtered_listings(session, backdrop_filter))
+
+    assert [g.gift_id for g in docs] == [1]
+    assert flt == backdrop_filter
+    assert session.count("filtered") == 1
+    assert session.count("listings") == 0
+
+
+def test_backdrop_filter_kept_on_empty_page(backdrop_filter):
+    # подходящих листингов нет, а без фильтра есть — это тихий рынок, не сбой
+    session = FakeSession([listing_doc(2, "Ivory White")])
+
+    docs, flt = asyncio.run(bot.fetch_filtered_listings(session, backdrop_filter))
+
+    assert docs == []
+    assert flt == backdrop_filter
+    assert session.count("filtered") == 1
+    assert session.count("listings") == 0
+
+
+def test_send_alert_does_not_retry_bad_request():
+    fake_bot = FakeBot([BadRequest("Can't parse entities")])
+
+    asyncio.run(bot.send_alert(fake_bot, "chat", "text", None))
+
+    assert fake_bot.calls == 1
+    assert fake_bot.sent == []
+
+
+def test_send_alert_retries_timeouts():
+    fake_bot = FakeBot([TimedOut(), TimedOut()])
+
+    asyncio.run(bot.send_alert(fake_bot, "chat", "text", None))
+
+    assert fake_bot.calls == 3
+    assert len(fake_bot.sent) == 1